@@ -1,19 +1,33 @@
 import os
 import re
+import sys
+import functools
+import random
 import time
-import json
+import logging
+import logging.handlers
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 import requests
+import ijson
+import orjson
 import gspread
+from requests.adapters import HTTPAdapter
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
 
 ##############################################################################
 #                    GEMENSAMMA KONSTANTER OCH FUNKTIONER                    #
 ##############################################################################
 
+# Loggning i stället för print(): detaljrader per produkt ligger på DEBUG
+# och formateras bara om de faktiskt ska skrivas ut (LOG_LEVEL=DEBUG).
+logger = logging.getLogger(__name__)
+
 # Endast "bestseller" som giltig variant, ej "best seller"
-RELEVANT_TAGS = {"male","female","unisex","bestseller"}
+# (redan gemener, så taggar jämförs efter .lower() utan att listan byggs om)
+RELEVANT_TAGS = frozenset({"male","female","unisex","bestseller"})
 
 # SERIES_MAPPING har också enbart "bestseller"
 SERIES_MAPPING = {
@@ -22,49 +36,406 @@ SERIES_MAPPING = {
     "unisex": "unisex",
     "bestseller": "bestsellers"
 }
+SERIES_TAGS = frozenset(SERIES_MAPPING)
+
+# Max antal samtidiga Shopify-anrop (trådar + limiter), styrs via SHOPIFY_CONCURRENCY
+API_CONCURRENCY = int(os.getenv("SHOPIFY_CONCURRENCY", "8"))
+
+# En gemensam Session för alla Shopify-anrop => TCP/TLS-anslutningar återanvänds
+# (keep-alive) i stället för en ny handskakning per anrop.
+# Token skickas fortfarande per anrop eftersom de två butikerna har olika tokens.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,                          # en pool per butiksdomän
+    pool_maxsize=max(API_CONCURRENCY, 16),       # minst en anslutning per tråd
+    # Inga omförsök här - safe_api_call äger alla omförsök (nätverksfel, 429, 5xx),
+    # annars multipliceras lagren med varandra
+    max_retries=0
+))
+# Gemensamma headers för alla anrop; komprimerade svar packas upp automatiskt.
+# Content-Type sätts bara på GraphQL-POST:arna (graphql_headers) - signerade
+# nedladdnings-URL:er (bulk-resultat) räknar in Content-Type i signaturen.
+SESSION.headers.update({
+    "Accept-Encoding": "gzip, deflate",
+    "Accept": "application/json",
+    "User-Agent": "obc-shopify-sync/1.0"
+})
+
+# Shopify Admin API-version för både REST och GraphQL
+# (minst 2024-07, för inventorySetQuantities med ignoreCompareQuantity)
+API_VERSION = "2024-07"
+
+@functools.lru_cache(maxsize=None)
+def admin_url(domain):
+    """
+    Bas-URL för Admin API:t i en butik, byggd en gång per domän.
+    """
+    return f"https://{domain}/admin/api/{API_VERSION}"
+
+@functools.lru_cache(maxsize=None)
+def shopify_headers(token):
+    """
+    Token-header per butik, byggd en gång per token (delas mellan anrop - mutera inte).
+    """
+    return {"X-Shopify-Access-Token": token}
+
+@functools.lru_cache(maxsize=None)
+def graphql_headers(token):
+    """
+    shopify_headers(token) plus Content-Type för GraphQL-anropens JSON-body.
+    """
+    return {**shopify_headers(token), "Content-Type": "application/json"}
+
+# Endast fälten skriptet faktiskt använder hämtas från /products.json
+PRODUCT_FIELDS = "id,title,tags,variants"
+
+# Max antal försök per anrop innan vi ger upp (nätverksfel eller 429)
+MAX_API_ATTEMPTS = 6
+
+# REST leaky bucket: 2 anrop/s återställs; nya anrop väntar när bucketen är över
+# REST_BUCKET_THRESHOLD full (t.ex. 32/40), så att trådarna har marginal kvar
+REST_REFILL_RATE = 2.0
+REST_BUCKET_THRESHOLD = 0.8
+
+# Senast kända bucket-läge per butik: host => (remaining, cap, tidpunkt)
+REST_BUCKETS = {}
+REST_BUCKETS_LOCK = threading.Lock()
+
+# GraphQL: pausa när färre kostnadspoäng än så här finns kvar i bucketen
+GRAPHQL_MIN_AVAILABLE = 100
+
+class AdaptiveLimiter:
+    """
+    Begränsar antalet samtidiga anrop med AIMD:
+    - 429 => halvera gränsen (minst 1)
+    - 10 lyckade anrop i rad => öka gränsen med 1 (högst max_limit)
+    """
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+        return False
+
+    def on_throttle(self):
+        with self.cond:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            logger.warning("[limiter] Strypt av Shopify, max samtidiga anrop => %d", self.limit)
+
+    def on_success(self):
+        with self.cond:
+            self.successes += 1
+            if self.successes >= 10 and self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.cond.notify_all()
+
+# En limiter per butik (host), precis som REST_BUCKETS: en strypning i den
+# ena butiken ska inte halvera samtidigheten i den andra
+API_LIMITERS = {}
+API_LIMITERS_LOCK = threading.Lock()
+
+def api_limiter(url):
+    """
+    AdaptiveLimiter för butiken i url, skapad vid första anropet.
+    """
+    host = urlsplit(url).netloc
+    with API_LIMITERS_LOCK:
+        limiter = API_LIMITERS.get(host)
+        if limiter is None:
+            limiter = API_LIMITERS[host] = AdaptiveLimiter(API_CONCURRENCY)
+    return limiter
+
+def record_rest_bucket(url, call_limit):
+    """
+    Sparar bucket-läget från X-Shopify-Shop-Api-Call-Limit ("used/cap") för
+    butiken i url, så att alla trådar kan se det innan nästa anrop.
+    """
+    if "/" not in call_limit:
+        return
+    used, cap = (int(x) for x in call_limit.split("/", 1))
+    with REST_BUCKETS_LOCK:
+        REST_BUCKETS[urlsplit(url).netloc] = (cap - used, cap, time.monotonic())
+
+def wait_for_rest_bucket(url):
+    """
+    Sover före ett anrop om butikens bucket (uppskattat med återfyllnaden sedan
+    senaste svaret) är mer än REST_BUCKET_THRESHOLD full - annars ingen paus alls.
+    GraphQL-anrop har en egen kostnadsbucket (wait_graphql_bucket) och väntar inte här.
+    """
+    if url.endswith("/graphql.json"):
+        return
+    with REST_BUCKETS_LOCK:
+        state = REST_BUCKETS.get(urlsplit(url).netloc)
+    if state is None:
+        return
+    remaining, cap, stamp = state
+    estimated = min(cap, remaining + (time.monotonic() - stamp) * REST_REFILL_RATE)
+    headroom = cap * (1 - REST_BUCKET_THRESHOLD)
+    if estimated < headroom:
+        time.sleep((headroom - estimated) / REST_REFILL_RATE)
+
+# Tillfälliga serverfel som försöks igen i safe_api_call
+RETRY_STATUSES = {502, 503, 504}
+# 500 försöks bara om för läsningar (GET) - en skrivning kan redan ha gått igenom
+RETRY_STATUSES_GET = RETRY_STATUSES | {500}
+
+def backoff_delay(attempt):
+    """
+    Exponentiell backoff (0.5, 1, 2, ... max 30s) plus slumpad jitter, så att
+    parallella trådar inte försöker igen exakt samtidigt.
+    """
+    return min(30, 0.5 * 2 ** (attempt - 1)) + random.uniform(0, 0.5)
 
 def safe_api_call(func, *args, **kwargs):
-    try:
-        r = func(*args, **kwargs)
-        time.sleep(1)
+    """
+    Ingen fast paus efter varje anrop - vi väntar bara när Shopify säger till:
+    - 429 => sov enligt Retry-After, halvera samtidigheten och försök igen
+    - REST-bucketen (X-Shopify-Shop-Api-Call-Limit) över 80 % full => vänta före anropet
+    Nätverksfel och 502/503/504 (500 bara för GET) försöks igen med backoff_delay
+    (exponentiell + jitter); efter MAX_API_ATTEMPTS kastas det sista nätverksfelet vidare.
+    Detta är det enda lagret med omförsök - SESSION:s adapter har max_retries=0.
+    """
+    url = args[0]
+    limiter = api_limiter(url)
+    retry_statuses = RETRY_STATUSES_GET if func == SESSION.get else RETRY_STATUSES
+    for attempt in range(1, MAX_API_ATTEMPTS + 1):
+        wait_for_rest_bucket(url)
+        try:
+            with limiter:  # väntetider nedan sker utanför limitern
+                r = func(*args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if attempt == MAX_API_ATTEMPTS:
+                raise
+            wait = backoff_delay(attempt)
+            logger.warning("[safe_api_call] Nätverksfel (försök %d/%d), väntar %.1fs: %s",
+                           attempt, MAX_API_ATTEMPTS, wait, e)
+            time.sleep(wait)
+            continue
+
+        if r.status_code in retry_statuses and attempt < MAX_API_ATTEMPTS:
+            wait = backoff_delay(attempt)
+            logger.warning("[safe_api_call] %s från Shopify (försök %d/%d), väntar %.1fs.",
+                           r.status_code, attempt, MAX_API_ATTEMPTS, wait)
+            r.close()
+            time.sleep(wait)
+            continue
+
+        if r.status_code == 429 and attempt < MAX_API_ATTEMPTS:
+            limiter.on_throttle()
+            wait = float(r.headers.get("Retry-After", "2"))
+            logger.warning("[safe_api_call] 429 från Shopify, väntar %ss.", wait)
+            r.close()  # släpp anslutningen tillbaka till poolen (även vid stream=True)
+            time.sleep(wait)
+            continue
+
+        limiter.on_success()
+        record_rest_bucket(url, r.headers.get("X-Shopify-Shop-Api-Call-Limit", ""))
         return r
-    except requests.exceptions.RequestException as e:
-        print("[safe_api_call] Nätverksfel:", e)
-        time.sleep(5)
-        return safe_api_call(func, *args, **kwargs)
+
+def load_json(response):
+    """
+    Parsar ett (icke-strömmat) Shopify-svar med orjson i stället för response.json().
+    """
+    return orjson.loads(response.content)
+
+# Shopify-paginering: Link: <https://...page_info=...>; rel="next"
+LINK_NEXT_RE = re.compile(r'<([^>]+)>\s*;\s*rel="?next"?')
+
+def parse_next_link(link_header):
+    """
+    Returnerar URL:en för nästa sida ur Link-headern, eller None.
+    """
+    m = LINK_NEXT_RE.search(link_header or "")
+    return m.group(1) if m else None
+
+def iter_rest_pages(endpoint, headers, params, caller, stream=False):
+    """
+    Generator över alla sidor (lyckade svar) för en paginerad REST-GET.
+    Följer Link-headern tills det inte finns någon nästa sida; vid fel
+    loggas det och pagineringen avbryts.
+    """
+    while True:
+        r = safe_api_call(SESSION.get, endpoint, headers=headers, params=params, stream=stream)
+        if r.status_code != 200:
+            logger.error("[%s] FEL %s: %s", caller, r.status_code, r.text)
+            return
+        yield r
+        endpoint = parse_next_link(r.headers.get("Link", ""))
+        if not endpoint:
+            return
+        params = {}
+
+# Skiftlägesokänslig sökning utan att bygga en ny gemen kopia av titeln
+SKIP_TITLE_RE = re.compile(r"sample|bundle", re.IGNORECASE)
 
 def skip_product_title(title:str)->bool:
-    lower_t = title.lower()
-    return ("sample" in lower_t or "bundle" in lower_t)
+    return SKIP_TITLE_RE.search(title) is not None
+
+# Kompileras en gång vid import i stället för vid varje anrop
+PERFUME_NUMBER_RE = re.compile(r"\b(\d{1,3}(?:\.\d+)?)(?!\s*\d)")
+
+# Minustecken-varianter som kan klistras in i arket => '-' i ett enda translate-pass:
+# U+2212 (minus), U+2013 (en dash), U+2014 (em dash), U+FE63 (small hyphen-minus),
+# U+FF0D (fullwidth hyphen-minus)
+MINUS_TRANSLATION = str.maketrans({c: "-" for c in "\u2212\u2013\u2014\ufe63\uff0d"})
 
+@functools.lru_cache(maxsize=4096)
 def extract_perfume_number_from_product_title(title:str):
-    pattern = r"\b(\d{1,3}(\.\d+)?)(?!\s*\d)"
-    match = re.search(pattern, title.lower())
+    """
+    Parfymnumret i titeln som nyckel (se perfume_key), eller None.
+    Cachad: store1-titlarna tolkas både i process_store1 och process_store2.
+    """
+    match = PERFUME_NUMBER_RE.search(title)
     if match:
         try:
-            return float(match.group(1))
+            return perfume_key(float(match.group(1)))
         except ValueError:
             return None
     return None
 
+def perfume_key(num:float):
+    """
+    Heltal (t.ex. 149.0) => int 149, annars float (t.ex. 33.1).
+    Samma nyckelform används för titlar och Google-lager.
+    """
+    return int(num) if num.is_integer() else num
+
 def normalize_minus_sign(value_str):
     if not value_str:
         return value_str
-    return (value_str
-            .replace('−','-')
-            .replace('\u2212','-'))
+    return value_str.translate(MINUS_TRANSLATION)
+
+def normalize_tags(tags):
+    """
+    Taggar => lista med trimmade gemener utan tomma. Görs en gång när
+    produkter och DB-cache läses in; strängarna internas eftersom samma
+    fåtal taggar återkommer på tusentals produkter.
+    """
+    return [sys.intern(t.strip().lower()) for t in tags if t.strip()]
+
+def merge_tags(*tag_lists):
+    """
+    Slår ihop flera (redan normaliserade, se normalize_tags) tagglistor till en mängd.
+    "best seller" standardiseras till "bestseller".
+    """
+    merged = set()
+    for tag_list in tag_lists:
+        merged.update(tag_list)
+    if "best seller" in merged:
+        merged.discard("best seller")
+        merged.add("bestseller")
+    return merged
 
 def build_series_list(tag_list):
     """
-    Returnerar en lista med kollektioner baserat på taggar som matchar SERIES_MAPPING.
-    T.ex. ['men','women','unisex','bestsellers'] beroende på vilka taggar som finns.
+    Returnerar kollektioner baserat på taggar som matchar SERIES_MAPPING.
+    T.ex. ('men','women','unisex','bestsellers') beroende på vilka taggar som finns.
+    Resultatet är en tuple (delas mellan anrop via cachen - ska inte muteras).
+    tag_list ska vara normaliserad (gemener), t.ex. utdata från merge_tags.
+    """
+    return series_for_tagset(frozenset(tag_list))
+
+@functools.lru_cache(maxsize=1024)
+def series_for_tagset(tag_set):
+    """
+    Cachad kärna till build_series_list: samma taggmängd => samma serier.
+    """
+    return tuple(sorted({SERIES_MAPPING[t] for t in tag_set & SERIES_TAGS}))
+
+##############################################################################
+#                  GOOGLE-AUTH: läs lagret ur Google Sheets                  #
+##############################################################################
+
+GOOGLE_SCOPES = ["https://spreadsheets.google.com/feeds","https://www.googleapis.com/auth/drive"]
+
+def google_credentials(creds_dict):
+    """
+    Service account-credentials för Google Sheets (google-auth). Token hämtas
+    vid första anropet och förnyas automatiskt.
     """
-    sset = set()
-    for t in tag_list:
-        l = t.lower()
-        if l in SERIES_MAPPING:
-            sset.add(SERIES_MAPPING[l])
-    return sorted(sset)
+    return Credentials.from_service_account_info(creds_dict, scopes=GOOGLE_SCOPES)
+
+def read_google_stock(gc_json):
+    """
+    Loggar in med service account-JSON:en och läser lagret ur arket "OBC lager".
+    Return => lista med (nummer, antal) från read_stock_rows.
+    """
+    google_creds = google_credentials(orjson.loads(gc_json))
+    gs = gspread.authorize(google_creds)
+    records = read_stock_rows(gs.open("OBC lager").sheet1)
+    return records
+
+def read_stock_rows(sheet):
+    """
+    Läser Google-lagret i ett enda anrop (hela arket som värderader) och
+    plockar ut kolumnerna "nummer:" och "Antal:" via rubrikradens index.
+    Värdena hämtas oformaterade, så numeriska celler kommer som int/float
+    och text som str. Returnerar en lista med (nummer, antal)-tupler.
+    Rader där nummer eller antal saknas tas bort direkt.
+    """
+    values = sheet.get_values(value_render_option="UNFORMATTED_VALUE")
+    if not values:
+        return []
+    header = values[0]
+    i_num = header.index("nummer:")
+    i_qty = header.index("Antal:")
+    rows = []
+    for row in values[1:]:
+        raw_n = row[i_num] if i_num < len(row) else ""
+        raw_a = row[i_qty] if i_qty < len(row) else ""
+        if isinstance(raw_n, str):
+            raw_n = raw_n.strip()
+        if isinstance(raw_a, str):
+            raw_a = raw_a.strip()
+        if raw_n == "" or raw_a == "":
+            continue  # tomma/ofullständiga rader skulle ändå hoppas över senare
+        rows.append((raw_n, raw_a))
+    return rows
+
+def parse_stock_row(raw_n, raw_a):
+    """
+    (nummer, antal) => (parfymnyckel, antal >= 0), eller None om raden inte
+    går att tolka. Numeriska celler används direkt; bara textceller behöver
+    minustecken-normalisering och strängtolkning. Antal som inte är heltal
+    (t.ex. 2.5) loggas och raden hoppas över.
+    """
+    if isinstance(raw_n, str):
+        raw_n = normalize_minus_sign(raw_n)
+    if isinstance(raw_a, str):
+        raw_a = normalize_minus_sign(raw_a)
+    if raw_n == "" or raw_a == "":
+        return None
+    if isinstance(raw_a, float) and not raw_a.is_integer():
+        # int() skulle trunkera 2.5 => 2; som förut (int("2.5")) hoppas raden över
+        logger.warning("[parse_stock_row] Antal %r för nummer %r är inget heltal, hoppar över raden.",
+                       raw_a, raw_n)
+        return None
+    try:
+        return perfume_key(float(raw_n)), max(int(raw_a), 0)
+    except ValueError:
+        return None
+
+def build_parfnum_map(records):
+    """
+    Bygger parfnum->antal ur Google-lagrets rader. Byggs en gång i main och
+    delas av båda butikerna. Vid dubbletter vinner sista raden, som förut.
+    """
+    return dict(filter(None, (parse_stock_row(raw_n, raw_a) for raw_n, raw_a in records)))
 
 ##############################################################################
 #       DB-FUNKTION: relevant_tags_cache => (product_id TEXT, tags TEXT)     #
@@ -73,222 +444,521 @@ def build_series_list(tag_list):
 def load_tags_cache(db_url):
     """
     Hämtar alla (product_id, tags) från tabellen relevant_tags_cache i DB.
-    Returnerar en dict { '8859929837910': ['BESTSELLER','Male'], ... }
+    Returnerar en dict { '8859929837910': ['bestseller','male'], ... } (normaliserade taggar)
+    Raderna läses som tupler via en server-side cursor (ingen dict per rad).
+    Anslutningen stängs även om frågan kastar ett fel.
     """
     conn = psycopg2.connect(db_url)
     store_dict={}
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT product_id, tags FROM relevant_tags_cache;")
-        rows = cur.fetchall()
-        for row in rows:
-            pid = row["product_id"]
-            tstr = row["tags"] or ""
-            tlist = tstr.split(",") if tstr else []
-            # Normalisera (ta bort extra spaces osv)
-            clean_tags = [x.strip() for x in tlist if x.strip()]
-            store_dict[pid] = clean_tags
-    conn.close()
+    try:
+        # Server-side cursor: raderna strömmas i block om itersize som tupler
+        with conn.cursor(name="tags_cache_cur") as cur:
+            cur.itersize = 5000
+            cur.execute("SELECT product_id, tags FROM relevant_tags_cache;")
+            for pid, tstr in cur:
+                # Normalisera (ta bort extra spaces osv)
+                store_dict[pid] = normalize_tags((tstr or "").split(","))
+    finally:
+        conn.close()
     return store_dict
 
 ##############################################################################
 #           HÄMTA ALLA PRODUKTER FRÅN EN STORE (id->product)                #
 ##############################################################################
 
+def iter_page_products(response):
+    """
+    Strömmar produkterna i ett /products.json-svar (stream=True) med ijson,
+    så att hela sidan aldrig behöver ligga som ett färdigparsat JSON-träd.
+    """
+    response.raw.decode_content = True  # packa upp gzip innan ijson läser
+    return ijson.items(response.raw, "products.item", use_float=True)
+
+def slim_product(p):
+    """
+    Behåller bara fälten skriptet använder, så att kartorna inte bär på
+    hela variant-objekten (pris, vikt, sku, ...) för varje produkt.
+    Taggarna lagras som färdig, normaliserad lista under "tag_list" och varianternas
+    lager-id:n som platt tuple under "inventory_item_ids".
+    """
+    return {
+        "id": p["id"],
+        "title": p.get("title", ""),
+        # Taggsträngen delas upp en gång här, inte i varje process_store*-loop
+        "tag_list": normalize_tags((p.get("tags") or "").split(",")),
+        "inventory_item_ids": tuple(
+            v["inventory_item_id"] for v in p.get("variants", []) if v.get("inventory_item_id")
+        )
+    }
+
+# Hämta produkter via GraphQL bulkOperationRunQuery (Shopify paginerar själv och
+# levererar en JSONL-fil). Sätt SHOPIFY_BULK_PRODUCTS=0 för att bara köra REST.
+USE_BULK_PRODUCTS = os.getenv("SHOPIFY_BULK_PRODUCTS", "1") != "0"
+BULK_POLL_SECONDS = 2
+BULK_TIMEOUT_SECONDS = 600
+
+BULK_PRODUCTS_MUTATION = """
+mutation {
+  bulkOperationRunQuery(query: \"\"\"
+    {
+      products {
+        edges {
+          node {
+            id
+            title
+            tags
+            variants { edges { node { id inventoryItem { id } } } }
+            collections { edges { node { id } } }
+          }
+        }
+      }
+    }
+  \"\"\") {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_STATUS_QUERY = """
+{ currentBulkOperation { id status errorCode url } }
+"""
+
+BULK_CANCEL_MUTATION = """
+mutation bulkOperationCancel($id: ID!) {
+  bulkOperationCancel(id: $id) {
+    userErrors { field message }
+  }
+}
+"""
+
+def gid_to_id(gid):
+    """ 'gid://shopify/Product/123' => 123 """
+    return int(gid.rsplit("/", 1)[1])
+
+def run_products_bulk_query(domain, token):
+    """
+    Startar en bulk-query för alla produkter och väntar tills den är klar.
+    Returnerar URL:en till JSONL-resultatet ("" om butiken saknar produkter),
+    eller None om bulk-operationen inte gick att köra => anroparen kör REST.
+    """
+    data = shopify_graphql(domain, token, BULK_PRODUCTS_MUTATION, {})
+    if data is None:
+        return None
+    errors = data["bulkOperationRunQuery"]["userErrors"]
+    if errors:
+        logger.warning("[bulk] Kunde inte starta bulk-query: %s", errors)
+        return None
+    op_id = data["bulkOperationRunQuery"]["bulkOperation"]["id"]
+    deadline = time.monotonic() + BULK_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(BULK_POLL_SECONDS)
+        status_data = shopify_graphql(domain, token, BULK_STATUS_QUERY, {})
+        op = (status_data or {}).get("currentBulkOperation")
+        if not op or op["id"] != op_id:
+            logger.warning("[bulk] Bulk-operationen %s hittades inte längre.", op_id)
+            return None
+        if op["status"] == "COMPLETED":
+            return op["url"] or ""
+        if op["status"] not in ("CREATED", "RUNNING"):
+            logger.warning("[bulk] Bulk-operationen slutade med %s (%s).", op["status"], op["errorCode"])
+            return None
+    logger.warning("[bulk] Bulk-operationen blev inte klar inom %ss, avbryter den.", BULK_TIMEOUT_SECONDS)
+    # Annars körs den vidare och nästa körnings bulkOperationRunQuery nekas
+    cancel = shopify_graphql(domain, token, BULK_CANCEL_MUTATION, {"id": op_id})
+    if cancel is not None and cancel["bulkOperationCancel"]["userErrors"]:
+        logger.warning("[bulk] Kunde inte avbryta %s: %s", op_id, cancel["bulkOperationCancel"]["userErrors"])
+    return None
+
+def iter_bulk_products(response):
+    """
+    Strömmar JSONL-resultatet från run_products_bulk_query (stream=True) rad för rad.
+    Varianter och kollektioner kommer som egna rader med __parentId direkt
+    efter sin produkt. Ger samma form som slim_product(...) plus
+    "collection_ids" (frozenset) - produktens nuvarande kollektioner, så att
+    update_collections_bulk inte behöver hämta collects separat.
+    sample/bundle hoppas över.
+    """
+    current = None
+    current_gid = None
+    inv_ids = []
+    coll_ids = []
+
+    def finish(product):
+        product["inventory_item_ids"] = tuple(inv_ids)
+        product["collection_ids"] = frozenset(coll_ids)
+        return product
+
+    for line in response.iter_lines():
+        if not line:
+            continue
+        obj = orjson.loads(line)
+        if "__parentId" in obj:
+            if obj["__parentId"] != current_gid:
+                continue  # barn till en produkt vi inte följer (ska inte hända)
+            if "inventoryItem" in obj:
+                if obj["inventoryItem"]:
+                    inv_ids.append(gid_to_id(obj["inventoryItem"]["id"]))
+            elif obj["id"].startswith("gid://shopify/Collection/"):
+                coll_ids.append(gid_to_id(obj["id"]))
+            continue
+        if current is not None and not skip_product_title(current["title"]):
+            yield finish(current)
+        current_gid = obj["id"]
+        current = {
+            "id": gid_to_id(current_gid),
+            "title": obj.get("title", ""),
+            "tag_list": normalize_tags(obj.get("tags", [])),
+        }
+        inv_ids = []
+        coll_ids = []
+    if current is not None and not skip_product_title(current["title"]):
+        yield finish(current)
+
+def iter_store_products(domain, token, caller="iter_store_products"):
+    """
+    Generator över alla produkter i en store. Försöker först med en GraphQL
+    bulk-query (en nedladdning); går den inte att köra hämtas produkterna
+    sida för sida via REST och Link-headern.
+    Varje produkt lämnas ut direkt som slim_product(...), så att en sida kan
+    släppas innan nästa hämtas. sample/bundle hoppas över.
+    """
+    if USE_BULK_PRODUCTS:
+        url = run_products_bulk_query(domain, token)
+        if url == "":
+            return  # klar bulk-operation utan resultat => inga produkter
+        if url is not None:
+            r = safe_api_call(SESSION.get, url, stream=True)  # signerad URL, ingen Shopify-token
+            if r.status_code == 200:
+                yield from iter_bulk_products(r)
+                return
+            logger.error("[%s] FEL %s vid nedladdning av bulk-resultat", caller, r.status_code)
+        logger.warning("[%s] Bulk-query misslyckades, hämtar via REST.", caller)
+
+    endpoint = admin_url(domain) + "/products.json"
+    headers = shopify_headers(token)
+    params = {"limit": 250, "fields": PRODUCT_FIELDS}
+    for r in iter_rest_pages(endpoint, headers, params, caller, stream=True):
+        for p in iter_page_products(r):
+            if skip_product_title(p.get("title", "")):
+                continue
+            yield slim_product(p)
+
 def fetch_store_id_map(domain, token):
     """
     Return => { product_id (str): product_dict }
     skip sample/bundle
     """
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + "/products.json"
-    headers = {"X-Shopify-Access-Token": token}
-    params = {"limit": 250}
-    out_map = {}
-    while True:
-        r = safe_api_call(requests.get, endpoint, headers=headers, params=params)
-        if r.status_code == 200:
-            data = r.json()
-            prods = data.get("products", [])
-            for p in prods:
-                pid = str(p["id"])
-                title = p.get("title", "")
-                if skip_product_title(title):
-                    continue
-                out_map[pid] = p
-            link_h = r.headers.get("Link", "")
-            next_link = None
-            if 'rel="next"' in link_h:
-                for part in link_h.split(','):
-                    if 'rel="next"' in part:
-                        next_link = part[part.find("<")+1:part.find(">")]
-                        break
-            if next_link:
-                endpoint = next_link
-                params = {}
-            else:
-                break
-        else:
-            print(f"[fetch_store_id_map] FEL {r.status_code}: {r.text}")
-            break
-    return out_map
+    return {
+        str(p["id"]): p
+        for p in iter_store_products(domain, token, "fetch_store_id_map")
+    }
 
 ##############################################################################
 #      HÄMTA PRODUKTER FRÅN STORE 2 => TITLE.LOWER() => product_dict         #
 ##############################################################################
 
 def fetch_store_title_map(domain, token):
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + "/products.json"
-    headers = {"X-Shopify-Access-Token": token}
-    params = {"limit": 250}
-    title_map = {}
-    while True:
-        r = safe_api_call(requests.get, endpoint, headers=headers, params=params)
-        if r.status_code == 200:
-            dd = r.json()
-            prods = dd.get("products", [])
-            for p in prods:
-                t = p.get("title", "")
-                if skip_product_title(t):
-                    continue
-                title_map[t.lower()] = p
-            link_h = r.headers.get("Link", "")
-            next_link = None
-            if 'rel="next"' in link_h:
-                for part in link_h.split(','):
-                    if 'rel="next"' in part:
-                        next_link = part[part.find("<")+1:part.find(">")]
-                        break
-            if next_link:
-                endpoint = next_link
-                params = {}
-            else:
-                break
-        else:
-            print(f"[fetch_store_title_map] FEL {r.status_code}: {r.text}")
-            break
-    return title_map
+    return {
+        p["title"].lower(): p
+        for p in iter_store_products(domain, token, "fetch_store_title_map")
+    }
 
 ##############################################################################
 #      INVENTORY, TAGS, KOLLEKTIONER - FUNKTIONER                            #
 ##############################################################################
 
-def update_inventory_level(domain, token, location_id, inventory_item_id, qty):
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + "/inventory_levels/set.json"
-    headers = {
-        "X-Shopify-Access-Token": token,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "location_id": location_id,
-        "inventory_item_id": inventory_item_id,
-        "available": qty
-    }
-    rr = safe_api_call(requests.post, endpoint, headers=headers, json=payload)
-    if rr.status_code == 200:
-        print(f"       => OK, lager satt till {qty}.")
-    else:
-        print(f"       => FEL {rr.status_code}: {rr.text}")
-
-def update_product_tags(domain, token, product_id, new_tags_list):
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + f"/products/{product_id}.json"
-    headers = {
-        "X-Shopify-Access-Token": token,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "product": {
-            "id": product_id,
-            "tags": ",".join(new_tags_list)
+INVENTORY_SET_MUTATION = """
+mutation inventorySetQuantities($input: InventorySetQuantitiesInput!) {
+  inventorySetQuantities(input: $input) {
+    userErrors { field message }
+  }
+}
+"""
+
+# Max antal (inventoryItem, antal)-par per mutation (Shopifys gräns). En
+# mutation kostar ~10 poäng oavsett antal par, så batchen ryms alltid i bucketen
+INVENTORY_BATCH_SIZE = 250
+
+def shopify_graphql(domain, token, query, variables):
+    """
+    Kör en GraphQL-fråga mot Shopify. Returnerar 'data' eller None vid fel.
+    """
+    endpoint = admin_url(domain) + "/graphql.json"
+    headers = graphql_headers(token)
+    payload = {"query": query, "variables": variables}
+    for attempt in range(1, MAX_API_ATTEMPTS + 1):
+        rr = safe_api_call(SESSION.post, endpoint, headers=headers, data=orjson.dumps(payload))
+        if rr.status_code != 200:
+            logger.error("       => FEL %s: %s", rr.status_code, rr.text)
+            return None
+        body = load_json(rr)
+        cost = body.get("extensions", {}).get("cost", {})
+        throttle = cost.get("throttleStatus", {})
+        errors = body.get("errors")
+        throttled = bool(errors) and all(
+            e.get("extensions", {}).get("code") == "THROTTLED" for e in errors
+        )
+        if throttled and attempt < MAX_API_ATTEMPTS:
+            # Vänta tills bucketen rymmer hela anropet (requestedQueryCost),
+            # annars blir omförsöket bara strypt igen
+            requested = cost.get("requestedQueryCost") or GRAPHQL_MIN_AVAILABLE
+            maximum = throttle.get("maximumAvailable")
+            if maximum is not None and requested > maximum:
+                logger.error("       => GraphQL-anropet kostar %s poäng, bucketen rymmer %s", requested, maximum)
+                return None
+            api_limiter(endpoint).on_throttle()
+            wait_graphql_bucket(throttle, requested)
+            continue
+        if errors:
+            logger.error("       => GraphQL-FEL: %s", errors)
+            return None
+        wait_graphql_bucket(throttle, GRAPHQL_MIN_AVAILABLE)
+        return body.get("data")
+    return None
+
+def wait_graphql_bucket(throttle, min_available):
+    """
+    Sover tills GraphQL-bucketen (extensions.cost.throttleStatus) har
+    minst min_available kostnadspoäng igen, utifrån restoreRate.
+    Gör inget om den redan har det.
+    """
+    available = throttle.get("currentlyAvailable")
+    restore = throttle.get("restoreRate") or 50
+    if available is not None and available < min_available:
+        time.sleep((min_available - available) / restore)
+
+def fetch_inventory_levels(domain, token, location_id):
+    """
+    Hämtar nuvarande lager på en location (paginerat, 250 per sida).
+    Return => { inventory_item_id (int): available }
+    """
+    endpoint = admin_url(domain) + "/inventory_levels.json"
+    headers = shopify_headers(token)
+    params = {"location_ids": location_id, "limit": 250}
+    levels = {}
+    for r in iter_rest_pages(endpoint, headers, params, "fetch_inventory_levels"):
+        for lvl in load_json(r).get("inventory_levels", []):
+            levels[lvl["inventory_item_id"]] = lvl.get("available")
+    return levels
+
+def stale_inventory_items(inv_ids, qty, levels):
+    """
+    Lager-id:n (ur produktens "inventory_item_ids") vars lager på locationen
+    (levels) inte redan är qty. Tom lista => inget lager att skriva.
+    levels innehåller "available" - samma kvantitet som set_inventory_levels_bulk()
+    sätter. available=None betyder att lagret inte spåras för varianten; där finns
+    inget att sätta, så de hoppas över i stället för att skrivas om varje körning.
+    Saknas varianten helt i levels skrivs den (aktiveras på locationen, se
+    set_inventory_levels_bulk).
+    """
+    stale = []
+    for inv_id in inv_ids:
+        if inv_id in levels and levels[inv_id] in (None, qty):
+            continue
+        stale.append(inv_id)
+    return stale
+
+def run_parallel(func, items):
+    """
+    Kör func(item) för alla items i en trådpool (API_CONCURRENCY trådar).
+    Shopify-anropen inuti begränsas ändå av butikens limiter i safe_api_call.
+    """
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=API_CONCURRENCY) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for f in futures:
+            f.result()  # låt eventuella fel bubbla upp som förut
+
+def run_concurrently(*calls):
+    """
+    Kör oberoende anrop samtidigt, t.ex. produkter och lagernivåer, eller
+    de två butikernas uppdateringar. calls är tupler (func, arg1, arg2, ...).
+    Returnerar resultaten i samma ordning som calls.
+    """
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [executor.submit(func, *args) for func, *args in calls]
+        return [f.result() for f in futures]
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def set_inventory_levels_bulk(domain, token, location_id, updates, levels):
+    """
+    Sätter lager för många varianter med inventorySetQuantities,
+    i stället för ett REST-anrop (inventory_levels/set.json) per variant.
+    Precis som inventory_levels/set.json sätts "available" (inte on-hand),
+    så reserverade/committade enheter påverkas inte.
+    updates är en lista [(inventory_item_id, qty), ...]; levels är locationens
+    nuvarande lager (fetch_inventory_levels). Varianter som saknas där är inte
+    kopplade till locationen och aktiveras i stället (activate_inventory_items).
+    Batcharna om INVENTORY_BATCH_SIZE skickas parallellt.
+    """
+    if not updates:
+        logger.info("   -> inga lageruppdateringar att skicka")
+        return
+    location_gid = f"gid://shopify/Location/{location_id}"
+    unstocked = [(inv_id, qty) for inv_id, qty in updates if inv_id not in levels]
+    if unstocked:
+        activate_inventory_items(domain, token, location_gid, unstocked)
+        updates = [(inv_id, qty) for inv_id, qty in updates if inv_id in levels]
+
+    def send_batch(batch):
+        variables = {
+            "input": {
+                "name": "available",
+                "reason": "correction",
+                "ignoreCompareQuantity": True,
+                "quantities": [
+                    {
+                        "inventoryItemId": f"gid://shopify/InventoryItem/{inv_id}",
+                        "locationId": location_gid,
+                        "quantity": qty
+                    }
+                    for inv_id, qty in batch
+                ]
+            }
         }
-    }
-    rr = safe_api_call(requests.put, endpoint, headers=headers, json=payload)
-    if rr.status_code == 200:
-        print(f"       => OK, taggar uppdaterade till: {new_tags_list}")
-    else:
-        print(f"       => FEL {rr.status_code}: {rr.text}")
-
-def get_collections_for_product(domain, token, product_id):
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + "/collects.json"
-    headers = {"X-Shopify-Access-Token": token}
-    params = {"product_id": product_id, "limit": 250}
-    col_map = {}
-    while True:
-        r = safe_api_call(requests.get, endpoint, headers=headers, params=params)
-        if r.status_code == 200:
-            dd = r.json()
-            c_list = dd.get("collects", [])
-            for c in c_list:
-                cid = c["collection_id"]
-                col_map[cid] = c["id"]
-            link_h = r.headers.get("Link", "")
-            next_link = None
-            if 'rel="next"' in link_h:
-                for part in link_h.split(','):
-                    if 'rel="next"' in part:
-                        next_link = part[part.find("<")+1:part.find(">")]
-                        break
-            if next_link:
-                endpoint = next_link
-                params = {}
-            else:
-                break
+        data = shopify_graphql(domain, token, INVENTORY_SET_MUTATION, variables)
+        if data is None:
+            return
+        errors = data["inventorySetQuantities"]["userErrors"]
+        if errors:
+            logger.error("       => FEL vid lageruppdatering: %s", errors)
         else:
-            print(f"[get_collections_for_product] FEL {r.status_code}: {r.text}")
-            break
-    return col_map
-
-def add_product_to_collection(domain, token, product_id, collection_id):
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + "/collects.json"
-    headers = {
-        "X-Shopify-Access-Token": token,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "collect": {
-            "product_id": product_id,
-            "collection_id": collection_id
+            logger.info("       => OK, lager satt för %d varianter.", len(batch))
+
+    run_parallel(send_batch, chunked(updates, INVENTORY_BATCH_SIZE))
+
+# Antal aliasade inventoryActivate per GraphQL-dokument (~10 poäng styck)
+INVENTORY_ACTIVATE_BATCH_SIZE = 10
+
+def activate_inventory_items(domain, token, location_gid, updates):
+    """
+    Kopplar varianter som ännu inte finns på locationen till den och sätter
+    deras lager ("available") i samma steg, med aliasade inventoryActivate
+    (a0, a1, ...). inventory_levels/set.json kopplade dem automatiskt;
+    inventorySetQuantities svarar i stället ITEM_NOT_STOCKED_AT_LOCATION.
+    updates är en lista [(inventory_item_id, qty), ...].
+    """
+    logger.info("   -> aktiverar %d varianter på locationen", len(updates))
+
+    def send_batch(batch):
+        var_defs = ", ".join(["$loc: ID!"] + [f"$i{n}: ID!, $q{n}: Int!" for n in range(len(batch))])
+        fields = "\n".join(
+            f"  a{n}: inventoryActivate(inventoryItemId: $i{n}, locationId: $loc, available: $q{n}) "
+            f"{{ userErrors {{ field message }} }}"
+            for n in range(len(batch))
+        )
+        query = f"mutation({var_defs}) {{\n{fields}\n}}"
+        variables = {"loc": location_gid}
+        for n, (inv_id, qty) in enumerate(batch):
+            variables[f"i{n}"] = f"gid://shopify/InventoryItem/{inv_id}"
+            variables[f"q{n}"] = qty
+        data = shopify_graphql(domain, token, query, variables)
+        if data is None:
+            return
+        for n, (inv_id, qty) in enumerate(batch):
+            errors = data[f"a{n}"]["userErrors"]
+            if errors:
+                logger.error("       => FEL vid aktivering av %s: %s", inv_id, errors)
+        logger.info("       => OK, %d varianter aktiverade.", len(batch))
+
+    run_parallel(send_batch, chunked(updates, INVENTORY_ACTIVATE_BATCH_SIZE))
+
+# Antal aliasade productUpdate per GraphQL-dokument. Varje productUpdate
+# kostar ~10 poäng, så ett dokument ~100 poäng - flera parallella batchar
+# ryms i en standard-bucket på 1000 poäng (50 poäng/s återställs)
+TAG_BATCH_SIZE = 10
+
+def update_product_tags_bulk(domain, token, tag_updates):
+    """
+    Uppdaterar taggar för många produkter med aliasade productUpdate-mutationer
+    (p0, p1, ...) - ett GraphQL-anrop per TAG_BATCH_SIZE produkter i stället
+    för en PUT /products/{id}.json per produkt. Batcharna skickas parallellt.
+    tag_updates är en lista [(product_id, [taggar]), ...].
+    """
+    if not tag_updates:
+        logger.info("   -> inga taggar att uppdatera")
+        return
+
+    def send_batch(batch):
+        var_defs = ", ".join(f"$i{n}: ProductInput!" for n in range(len(batch)))
+        fields = "\n".join(
+            f"  p{n}: productUpdate(input: $i{n}) {{ userErrors {{ field message }} }}"
+            for n in range(len(batch))
+        )
+        query = f"mutation({var_defs}) {{\n{fields}\n}}"
+        variables = {
+            f"i{n}": {"id": f"gid://shopify/Product/{pid}", "tags": list(tags)}
+            for n, (pid, tags) in enumerate(batch)
         }
-    }
-    rr = safe_api_call(requests.post, endpoint, headers=headers, json=payload)
-    if rr.status_code == 201:
-        print(f"       => OK, lade till produkt {product_id} i kollektion {collection_id}")
-    else:
-        print(f"       => FEL {rr.status_code}: {rr.text}")
-
-def remove_product_from_collection(domain, token, collect_id):
-    base_url = f"https://{domain}/admin/api/2023-07"
-    endpoint = base_url + f"/collects/{collect_id}.json"
-    headers = {"X-Shopify-Access-Token": token}
-    rr = safe_api_call(requests.delete, endpoint, headers=headers)
-    if rr.status_code == 200:
-        print(f"       => OK, tog bort collect {collect_id}")
-    else:
-        print(f"       => FEL {rr.status_code}: {rr.text}")
-
-def update_collections_for_product(domain, token, product_id, new_series, col_map):
-    """
-    Uppdaterar vilka kollektioner (serier) produkten ska ligga i.
+        data = shopify_graphql(domain, token, query, variables)
+        if data is None:
+            return
+        for n, (pid, tags) in enumerate(batch):
+            errors = data[f"p{n}"]["userErrors"]
+            if errors:
+                logger.error("       => FEL vid tagguppdatering för %s: %s", pid, errors)
+            else:
+                logger.debug("       => OK, taggar för %s uppdaterade till: %s", pid, tags)
+        logger.info("       => OK, taggar skickade för %d produkter.", len(batch))
+
+    run_parallel(send_batch, chunked(tag_updates, TAG_BATCH_SIZE))
+
+def fetch_collects_map(domain, token, collection_ids):
+    """
+    Hämtar alla collects för våra kollektioner i förväg (en paginerad GET per
+    kollektion) i stället för en GET /collects.json?product_id=... per produkt.
+    Return => { product_id (str): { collection_id: collect_id } }
+    """
+    base_url = admin_url(domain)
+    headers = shopify_headers(token)
+    out_map = {}
+    for coll_id in set(collection_ids):
+        if not coll_id:
+            continue  # kollektion ej konfigurerad (env saknas => 0)
+        params = {"collection_id": coll_id, "limit": 250}
+        for r in iter_rest_pages(base_url + "/collects.json", headers, params, "fetch_collects_map"):
+            for c in load_json(r).get("collects", []):
+                out_map.setdefault(str(c["product_id"]), {})[c["collection_id"]] = c["id"]
+    return out_map
+
+COLLECTION_ADD_MUTATION = """
+mutation collectionAddProducts($id: ID!, $productIds: [ID!]!) {
+  collectionAddProducts(id: $id, productIds: $productIds) {
+    userErrors { field message }
+  }
+}
+"""
+
+COLLECTION_REMOVE_MUTATION = """
+mutation collectionRemoveProducts($id: ID!, $productIds: [ID!]!) {
+  collectionRemoveProducts(id: $id, productIds: $productIds) {
+    userErrors { field message }
+  }
+}
+"""
+
+# Max antal produkter per collectionAddProducts/collectionRemoveProducts
+# (Shopifys gräns); en mutation kostar ~10 poäng oavsett antal produkter
+COLLECTION_BATCH_SIZE = 250
+
+def collection_changes(new_series, col_map, existing_ids):
+    """
+    Vilka kollektioner en produkt ska läggas till i resp. tas bort ur.
     new_series är en lista, t.ex. ['men','unisex'].
     col_map är en dict { 'men': ID, 'women':ID, 'unisex':ID, 'bestsellers':ID }.
-    
+    existing_ids är produktens nuvarande kollektions-ID:n (från fetch_collects_map).
+    Return => (add_ids, remove_ids)
+
     Justering: vi tar bara bort produkten från kollektioner som också
     finns i col_map. Andra kollektioner (irrelevanta för detta skript) lämnas kvar.
     """
-    existing_map = get_collections_for_product(domain, token, product_id)
-    
-    # Vilka kollektions-ID vi vill ha enligt new_series
-    wanted_ids = set()
-    for s in new_series:
-        if s in col_map:
-            wanted_ids.add(col_map[s])
-
-    existing_ids = set(existing_map.keys())
-    relevant_collection_ids = set(col_map.values())  # Endast våra "kända" kollektioner
+    # Vilka kollektions-ID vi vill ha enligt new_series (0 = ej konfigurerad, hoppas över)
+    wanted_ids = {col_map[s] for s in new_series if col_map.get(s)}
+    relevant_collection_ids = {cid for cid in col_map.values() if cid}  # Endast våra "kända" kollektioner
 
     # Kollektions-ID som ska läggas till: de som finns i wanted_ids men inte redan är där
     add_ids = wanted_ids - existing_ids
@@ -296,59 +966,96 @@ def update_collections_for_product(domain, token, product_id, new_series, col_ma
     # Kollektions-ID som ska tas bort: de som redan finns, men endast om de är bland våra
     # kända kollektioner, och inte längre är i wanted_ids.
     remove_ids = (existing_ids & relevant_collection_ids) - wanted_ids
+    return add_ids, remove_ids
 
-    if add_ids:
-        print(f"   -> kollektioner att LÄGGA TILL: {list(add_ids)}")
+def update_collections_bulk(domain, token, jobs, col_map):
+    """
+    Synkar kollektionsmedlemskap för många produkter på en gång.
+    jobs är en lista [(product_id, serier, nuvarande kollektions-ID:n), ...].
+    Nuvarande kollektioner kommer från bulk-hämtningen; är de None (REST-vägen)
+    hämtas medlemskapet för alla produkter på en gång (fetch_collects_map).
+    Ändringarna grupperas sedan per kollektion och skickas som
+    collectionAddProducts/collectionRemoveProducts med upp till
+    COLLECTION_BATCH_SIZE produkter per anrop, i stället för en POST/DELETE
+    /collects per produkt och kollektion. Batcharna skickas parallellt.
+    """
+    if not jobs:
+        return
+    collects_map = None
+    if any(existing is None for _, _, existing in jobs):
+        collects_map = fetch_collects_map(domain, token, col_map.values())
+    adds = {}     # collection_id -> [product_id, ...]
+    removes = {}  # collection_id -> [product_id, ...]
+    for pid, series, existing in jobs:
+        if existing is None:
+            existing = collects_map.get(pid, {}).keys()
+        add_ids, remove_ids = collection_changes(series, col_map, existing)
+        if add_ids:
+            logger.debug("   -> %s: kollektioner att LÄGGA TILL: %s", pid, list(add_ids))
+        if remove_ids:
+            logger.debug("   -> %s: kollektioner att TA BORT: %s", pid, list(remove_ids))
         for cid in add_ids:
-            add_product_to_collection(domain, token, product_id, cid)
-    else:
-        print("   -> inga nya kollektioner att lägga till")
-
-    if remove_ids:
-        print(f"   -> kollektioner att TA BORT: {list(remove_ids)}")
+            adds.setdefault(cid, []).append(pid)
         for cid in remove_ids:
-            c_id = existing_map[cid]
-            remove_product_from_collection(domain, token, c_id)
-    else:
-        print("   -> inga kollektioner att ta bort")
+            removes.setdefault(cid, []).append(pid)
+
+    batches = [
+        (mutation, name, cid, batch)
+        for mutation, name, by_coll in (
+            (COLLECTION_ADD_MUTATION, "collectionAddProducts", adds),
+            (COLLECTION_REMOVE_MUTATION, "collectionRemoveProducts", removes),
+        )
+        for cid, pids in by_coll.items()
+        for batch in chunked(pids, COLLECTION_BATCH_SIZE)
+    ]
+    if not batches:
+        logger.info("   -> inga kollektionsändringar att skicka")
+        return
+
+    def send_batch(item):
+        mutation, name, cid, batch = item
+        variables = {
+            "id": f"gid://shopify/Collection/{cid}",
+            "productIds": [f"gid://shopify/Product/{pid}" for pid in batch]
+        }
+        data = shopify_graphql(domain, token, mutation, variables)
+        if data is None:
+            return
+        errors = data[name]["userErrors"]
+        if errors:
+            logger.error("       => FEL vid %s för kollektion %s: %s", name, cid, errors)
+        else:
+            logger.info("       => OK, %s: %d produkter i kollektion %s.", name, len(batch), cid)
+
+    run_parallel(send_batch, batches)
 
 ##############################################################################
 #            UPPDATERA STORE 1: DIREKT MATCH product_id => DB                #
 ##############################################################################
 
-def process_store1(db_tags, domain, token, location_id, coll_map, records):
+def process_store1(db_tags, store_map, domain, token, location_id, coll_map, parfnum_map):
     """
-    1) Bygg parfnum->antal (Google-lager)
-    2) Hämta store1_products => id->product
+    1) parfnum->antal (Google-lager) kommer färdigbyggd från main
+    2) store1_products => id->product kommer också från main (delas med process_store2)
     3) För varje produkt i store1:
        - extrahera parfnum
-       - sätt lager
-       - uppdatera taggar
-       - uppdatera kollektioner
+       - samla lager (sätts i ett svep efter loopen)
+       - samla taggar (skickas i ett svep efter loopen)
+       - samla kollektioner (synkas parallellt efter loopen)
        - logga tydligt vad som händer
     """
-    print("\n--- process_store1 ---\n")
+    logger.info("--- process_store1 ---")
 
-    # (1) Bygg parfnum->antal (från Google-lager)
-    parfnum_map = {}
-    for r in records:
-        raw_n = normalize_minus_sign(str(r.get("nummer:", "")))
-        raw_a = normalize_minus_sign(str(r.get("Antal:", "")))
-        if not raw_n or not raw_a:
-            continue
-        try:
-            nf = float(raw_n)
-            ai = int(raw_a)
-            if ai < 0:
-                ai = 0
-            parfnum_map[nf] = ai
-        except ValueError:
-            pass
+    # (1) parfnum->antal (från Google-lager) är byggd en gång i main
 
-    # (2) Hämta store1-products (id->product)
-    store_map = fetch_store_id_map(domain, token)
+    # (2) store1-products (id->product) är hämtade i main; hämta nuvarande lager på locationen
+    levels = fetch_inventory_levels(domain, token, location_id)
 
     # (3) Gå igenom alla relevanta produkter
+    inventory_updates = []  # (inventory_item_id, qty) - skickas i ett svep i (4)
+    tag_updates = []        # (product_id, taggar) - skickas i ett svep i (4)
+    collection_jobs = []    # (product_id, serier, nuvarande kollektioner) - körs parallellt i (4)
+    unchanged = 0           # produkter där lager, taggar och kollektioner redan stämmer
     for pid, product_data in store_map.items():
         title = product_data.get("title", "")
         parfnum = extract_perfume_number_from_product_title(title)
@@ -358,178 +1065,191 @@ def process_store1(db_tags, domain, token, location_id, coll_map, records):
         # Hämta lager från Google-lager
         qty = parfnum_map.get(parfnum)
         if qty is None:
-            print(f"  => Ingen Google-lagerinfo för parfymnr={parfnum} (title='{title}'), skippar.")
+            logger.debug("  => Ingen Google-lagerinfo för parfymnr=%s (title='%s'), skippar.", parfnum, title)
             continue
 
+        # Existerande taggar i Shopify (för att slå ihop), redan uppdelade i slim_product
+        shopify_list = product_data["tag_list"]
+
         # Hämta taggar från DB om finns, annars från Shopify
-        if pid in db_tags:
-            taglist = db_tags[pid][:]
-        else:
-            st = product_data.get("tags", "")
-            st_list = [t.strip() for t in st.split(",") if t.strip()]
-            taglist = st_list
-        
-        # Hämta existerande taggar i Shopify (för att slå ihop)
-        shopify_existing = product_data.get("tags", "")
-        shopify_list = [t.strip() for t in shopify_existing.split(",") if t.strip()]
+        taglist = db_tags.get(pid, shopify_list)
 
         # Slå ihop DB-taggar och Shopify-taggar, standardisera "best seller" -> "bestseller"
-        combined_tags = []
-        for x in (taglist + shopify_list):
-            lx = x.lower()
-            if lx == "best seller":
-                lx = "bestseller"
-            combined_tags.append(lx)
-        combined_set = set(combined_tags)
+        combined_set = merge_tags(taglist, shopify_list)
 
         # För debug: spara gamla innan vi ändrar
-        old_shopify_tags = list(shopify_list)
+        old_shopify_tags = shopify_list
+
+        # qty=0 => relevanta taggar bort, annars merge
+        new_set = combined_set - RELEVANT_TAGS if qty == 0 else combined_set
+
+        # qty=0 => ur samtliga kollektioner, annars enligt taggarna
+        series_list = build_series_list(new_set) if qty else []
+
+        # Inget att skriva om lager, taggar och kollektioner redan stämmer i Shopify
+        # (taggarna jämförs som mängder - sorteras bara om de ska skrivas;
+        # kollektioner okända från REST-vägen (None) kontrolleras alltid)
+        stale = stale_inventory_items(product_data["inventory_item_ids"], qty, levels)
+        tags_changed = new_set != set(shopify_list)
+        collection_ids = product_data.get("collection_ids")
+        collections_changed = collection_ids is None or any(
+            collection_changes(series_list, coll_map, collection_ids))
+        if not tags_changed and not stale and not collections_changed:
+            logger.debug("  => PID=%s oförändrad (lager=%s, taggar=%s), skippar.", pid, qty, shopify_list)
+            unchanged += 1
+            continue
+        new_t = sorted(new_set)
 
-        # Sätt lager (inventory)
-        print(f"\n** [STORE1] Hanterar produkt: PID={pid}, Titel='{title}', Parfymnr={parfnum}, Lager={qty} **")
-        variants = product_data.get("variants", [])
-        for var in variants:
-            inv_id = var.get("inventory_item_id")
-            if inv_id:
-                update_inventory_level(domain, token, location_id, inv_id, qty)
+        # Samla lager (inventory) - skickas efter loopen, bara varianter som skiljer
+        logger.debug("** [STORE1] Hanterar produkt: PID=%s, Titel='%s', Parfymnr=%s, Lager=%s **", pid, title, parfnum, qty)
+        inventory_updates.extend((inv_id, qty) for inv_id in stale)
 
         # Beroende på om qty=0 ska vi ev ta bort relevanta taggar/kollektioner
         if qty == 0:
-            # Ta bort relevanta taggar i RELEVANT_TAGS
-            new_t = []
-            for t in combined_set:
-                if t not in RELEVANT_TAGS:
-                    new_t.append(t)
-            new_t = sorted(list(set(new_t)))  # unik & sorterad
-            print(f"   Gamla Shopify-taggar: {old_shopify_tags}")
-            print(f"   Nya Shopify-taggar (efter borttagning): {new_t}")
-            update_product_tags(domain, token, pid, new_t)
-
-            print("   => Tar bort samtliga kollektioner (eftersom qty=0).")
-            update_collections_for_product(domain, token, pid, [], coll_map)
+            # Relevanta taggar i RELEVANT_TAGS är redan borttagna ur new_t
+            logger.debug("   Gamla Shopify-taggar: %s", old_shopify_tags)
+            logger.debug("   Nya Shopify-taggar (efter borttagning): %s", new_t)
+            if tags_changed:
+                tag_updates.append((pid, new_t))
 
-        else:
-            # Lägg till relevanta taggar om de saknas
-            new_t = sorted(list(combined_set))
-            print(f"   Gamla Shopify-taggar: {old_shopify_tags}")
-            print(f"   Nya Shopify-taggar (efter merge): {new_t}")
-            update_product_tags(domain, token, pid, new_t)
+            if collections_changed:
+                logger.debug("   => Tar bort samtliga kollektioner (eftersom qty=0).")
+                collection_jobs.append((pid, series_list, collection_ids))
 
-            # Bygg ny kollektionslista
-            series_list = build_series_list(new_t)
-            print(f"   => Vill uppdatera kollektioner till: {series_list}")
-            update_collections_for_product(domain, token, pid, series_list, coll_map)
+        else:
+            # Relevanta taggar från DB är redan tillagda i new_t
+            logger.debug("   Gamla Shopify-taggar: %s", old_shopify_tags)
+            logger.debug("   Nya Shopify-taggar (efter merge): %s", new_t)
+            if tags_changed:
+                tag_updates.append((pid, new_t))
+
+            # Ny kollektionslista (byggd ovan)
+            if collections_changed:
+                logger.debug("   => Vill uppdatera kollektioner till: %s", series_list)
+                collection_jobs.append((pid, series_list, collection_ids))
+
+    # (4) Sätt lager och taggar i ett svep, synka kollektioner parallellt
+    logger.info("** [STORE1] %d produkter oförändrade, skippade **", unchanged)
+    logger.info("** [STORE1] Sätter lager för %d varianter **", len(inventory_updates))
+    set_inventory_levels_bulk(domain, token, location_id, inventory_updates, levels)
+    logger.info("** [STORE1] Uppdaterar taggar för %d produkter **", len(tag_updates))
+    update_product_tags_bulk(domain, token, tag_updates)
+    logger.info("** [STORE1] Uppdaterar kollektioner för %d produkter **", len(collection_jobs))
+    update_collections_bulk(domain, token, collection_jobs, coll_map)
 
 ##############################################################################
 #         UPPDATERA STORE 2: “översätt” via Store 1 “title” => Store 2       #
 ##############################################################################
 
 def process_store2(db_tags,
-                   store1_domain, store1_token,
+                   store1_id_map,
                    store2_domain, store2_token, store2_location,
-                   store2_coll_map, records):
+                   store2_coll_map, parfnum_map):
     """
-    1) Bygg parfnum->antal (Google-lager)
-    2) Hämta store1 => id->product => skip sample => ger title
+    1) parfnum->antal (Google-lager) kommer färdigbyggd från main
+    2) store1 => id->product (samma karta som process_store1 fick) => ger title
     3) Hämta store2 => title.lower()->product
     4) loopa igenom products i store1, matcha parfnum => db_tags => uppdatera store2
+    5) sätt lager och taggar för alla matchade produkter i store2 i ett svep,
+       och synka deras kollektioner parallellt
     """
-    print("\n--- process_store2 (översätt via title) ---\n")
+    logger.info("--- process_store2 (översätt via title) ---")
 
-    # (A) Bygg parfnum-lager (från Google-lager)
-    parfnum_map = {}
-    for r in records:
-        raw_n = normalize_minus_sign(str(r.get("nummer:", "")))
-        raw_a = normalize_minus_sign(str(r.get("Antal:", "")))
-        if not raw_n or not raw_a:
-            continue
-        try:
-            nf = float(raw_n)
-            ai = int(raw_a)
-            if ai < 0:
-                ai = 0
-            parfnum_map[nf] = ai
-        except ValueError:
-            pass
+    # (A) parfnum->antal (från Google-lager) är byggd en gång i main
 
-    # (B) store1_id->product
-    store1_id_map = fetch_store_id_map(store1_domain, store1_token)
-    # (C) store2_title->product
-    store2_title_map = fetch_store_title_map(store2_domain, store2_token)
+    # (B) store1_id->product är hämtad en gång i main
+    # (C) store2_title->product och nuvarande lager på store2-locationen, samtidigt
+    store2_title_map, levels = run_concurrently(
+        (fetch_store_title_map, store2_domain, store2_token),
+        (fetch_inventory_levels, store2_domain, store2_token, store2_location),
+    )
 
     # (D) Loopa store1-produkter och kolla db_tags => uppdatera store2
+    inventory_updates = []  # (inventory_item_id, qty) - skickas i ett svep i (E)
+    tag_updates = []        # (product_id, taggar) - skickas i ett svep i (E)
+    collection_jobs = []    # (product_id, serier, nuvarande kollektioner) - körs parallellt i (E)
+    unchanged = 0           # produkter där lager, taggar och kollektioner redan stämmer
     for pid, product_data in store1_id_map.items():
         title = product_data.get("title", "")
         parfnum = extract_perfume_number_from_product_title(title)
         if parfnum is None:
             continue
         if parfnum not in parfnum_map:
-            print(f"  => Ingen lagerinfo för parfymnr={parfnum} i Google-lager (title='{title}'), skippar.")
+            logger.debug("  => Ingen lagerinfo för parfymnr=%s i Google-lager (title='%s'), skippar.", parfnum, title)
             continue
         qty = parfnum_map[parfnum]
 
         # Hämta taggar för store1-produkten från DB eller Shopify
-        if pid in db_tags:
-            taglist = db_tags[pid][:]
-        else:
-            st = product_data.get("tags", "")
-            st_list = [t.strip() for t in st.split(",") if t.strip()]
-            taglist = st_list
+        taglist = db_tags.get(pid, product_data["tag_list"])
 
         # Hitta motsvarande produkt i store2 via title.lower()
         s2_product = store2_title_map.get(title.lower())
         if not s2_product:
-            print(f"  => Hittar ingen match i store2 för title='{title}'")
+            logger.debug("  => Hittar ingen match i store2 för title='%s'", title)
             continue
 
         s2_pid = str(s2_product["id"])
-        variants = s2_product.get("variants", [])
 
-        print(f"\n** [STORE2] Hanterar produkt: Titel='{title}', Parfymnr={parfnum}, PID={s2_pid}, Lager={qty} **")
+        # Kombinera DB-taggar med befintliga Shopify-taggar (store2), standardisera "best seller" -> "bestseller" 
+        s2_list = s2_product["tag_list"]
 
-        # Sätt lager i store2
-        for var in variants:
-            inv_id = var.get("inventory_item_id")
-            if inv_id:
-                update_inventory_level(store2_domain, store2_token, store2_location, inv_id, qty)
+        combined_set = merge_tags(taglist, s2_list)
 
-        # Kombinera DB-taggar med befintliga Shopify-taggar (store2), standardisera "best seller" -> "bestseller" 
-        s2_existing = s2_product.get("tags", "")
-        s2_list = [t.strip() for t in s2_existing.split(",") if t.strip()]
+        old_store2_tags = s2_list
+
+        new_set = combined_set - RELEVANT_TAGS if qty == 0 else combined_set
 
-        combined_tags = []
-        for x in (taglist + s2_list):
-            lx = x.lower()
-            if lx == "best seller":
-                lx = "bestseller"
-            combined_tags.append(lx)
-        combined_set = set(combined_tags)
+        # qty=0 => ur samtliga kollektioner, annars enligt taggarna
+        series_list = build_series_list(new_set) if qty else []
 
-        old_store2_tags = list(s2_list)
+        # Inget att skriva om lager, taggar och kollektioner redan stämmer i store2
+        # (taggarna jämförs som mängder - sorteras bara om de ska skrivas;
+        # kollektioner okända från REST-vägen (None) kontrolleras alltid)
+        stale = stale_inventory_items(s2_product["inventory_item_ids"], qty, levels)
+        tags_changed = new_set != set(s2_list)
+        collection_ids = s2_product.get("collection_ids")
+        collections_changed = collection_ids is None or any(
+            collection_changes(series_list, store2_coll_map, collection_ids))
+        if not tags_changed and not stale and not collections_changed:
+            logger.debug("  => store2 PID=%s oförändrad (lager=%s, taggar=%s), skippar.", s2_pid, qty, s2_list)
+            unchanged += 1
+            continue
+        new_t = sorted(new_set)
+
+        logger.debug("** [STORE2] Hanterar produkt: Titel='%s', Parfymnr=%s, PID=%s, Lager=%s **", title, parfnum, s2_pid, qty)
+
+        # Samla lager i store2 - skickas efter loopen, bara varianter som skiljer
+        inventory_updates.extend((inv_id, qty) for inv_id in stale)
 
         if qty == 0:
-            # ta bort relevanta
-            new_t = []
-            for t in combined_set:
-                if t not in RELEVANT_TAGS:
-                    new_t.append(t)
-            new_t = sorted(list(set(new_t)))
-            print(f"   Gamla Shopify-taggar i store2: {old_store2_tags}")
-            print(f"   Nya Shopify-taggar (efter borttagning): {new_t}")
-            update_product_tags(store2_domain, store2_token, s2_pid, new_t)
-
-            print("   => Tar bort samtliga kollektioner i store2 (qty=0).")
-            update_collections_for_product(store2_domain, store2_token, s2_pid, [], store2_coll_map)
+            # relevanta taggar redan borttagna ur new_t
+            logger.debug("   Gamla Shopify-taggar i store2: %s", old_store2_tags)
+            logger.debug("   Nya Shopify-taggar (efter borttagning): %s", new_t)
+            if tags_changed:
+                tag_updates.append((s2_pid, new_t))
 
-        else:
-            new_t = sorted(list(combined_set))
-            print(f"   Gamla Shopify-taggar i store2: {old_store2_tags}")
-            print(f"   Nya Shopify-taggar (efter merge): {new_t}")
-            update_product_tags(store2_domain, store2_token, s2_pid, new_t)
+            if collections_changed:
+                logger.debug("   => Tar bort samtliga kollektioner i store2 (qty=0).")
+                collection_jobs.append((s2_pid, series_list, collection_ids))
 
-            series_list = build_series_list(new_t)
-            print(f"   => Vill uppdatera kollektioner i store2 till: {series_list}")
-            update_collections_for_product(store2_domain, store2_token, s2_pid, series_list, store2_coll_map)
+        else:
+            logger.debug("   Gamla Shopify-taggar i store2: %s", old_store2_tags)
+            logger.debug("   Nya Shopify-taggar (efter merge): %s", new_t)
+            if tags_changed:
+                tag_updates.append((s2_pid, new_t))
+
+            if collections_changed:
+                logger.debug("   => Vill uppdatera kollektioner i store2 till: %s", series_list)
+                collection_jobs.append((s2_pid, series_list, collection_ids))
+
+    # (E) Sätt lager och taggar i store2 i ett svep, synka kollektioner parallellt
+    logger.info("** [STORE2] %d produkter oförändrade, skippade **", unchanged)
+    logger.info("** [STORE2] Sätter lager för %d varianter **", len(inventory_updates))
+    set_inventory_levels_bulk(store2_domain, store2_token, store2_location, inventory_updates, levels)
+    logger.info("** [STORE2] Uppdaterar taggar för %d produkter **", len(tag_updates))
+    update_product_tags_bulk(store2_domain, store2_token, tag_updates)
+    logger.info("** [STORE2] Uppdaterar kollektioner för %d produkter **", len(collection_jobs))
+    update_collections_bulk(store2_domain, store2_token, collection_jobs, store2_coll_map)
 
 ##############################################################################
 #                                   MAIN                                     #
@@ -559,59 +1279,88 @@ def main():
         s2_uni = int(os.getenv("STORE2_UNISEX_COLLECTION_ID","0"))
         s2_best = int(os.getenv("STORE2_BESTSELLERS_COLLECTION_ID","0"))
 
-        # 2) Google-lager
         gc_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
         if not gc_json:
             raise ValueError("Saknas GOOGLE_CREDENTIALS_JSON")
-        scope = ["https://spreadsheets.google.com/feeds","https://www.googleapis.com/auth/drive"]
-        creds_dict = json.loads(gc_json)
-        google_creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        gs = gspread.authorize(google_creds)
-
-        sheet = gs.open("OBC lager").sheet1
-        records = sheet.get_all_records(expected_headers=["nummer:", "Antal:"])
-        print(f"[main] => {len(records)} rader i Google-lager.\n")
-
-        # 3) Ladda DB (relevant_tags_cache)
-        db_tags = load_tags_cache(db_url)
-
-        # 4) Uppdatera Store1 direkt (master)
-        print("\n--- [UPPDATERA STORE 1] ---\n")
-        process_store1(
-            db_tags,
-            s1_domain,
-            s1_token,
-            s1_loc,
-            {
-                "men": s1_men,
-                "women": s1_women,
-                "unisex": s1_uni,
-                "bestsellers": s1_best
-            },
-            records
-        )
 
-        # 5) Uppdatera Store2 genom att matcha "title" från Store1
-        print("\n--- [UPPDATERA STORE 2] ---\n")
-        process_store2(
-            db_tags,
-            s1_domain, s1_token,    # vi hämtar store1-produkt => "title"
-            s2_domain, s2_token,    # uppdaterar store2
-            s2_loc,
-            {
-                "men": s2_men,
-                "women": s2_women,
-                "unisex": s2_uni,
-                "bestsellers": s2_best
-            },
-            records
+        # 2) Google-lager, DB (relevant_tags_cache) och store1-produkter är
+        #    oberoende av varandra => hämtas samtidigt. store1-kartan används
+        #    av både process_store1 och process_store2.
+        records, db_tags, store1_map = run_concurrently(
+            (read_google_stock, gc_json),
+            (load_tags_cache, db_url),
+            (fetch_store_id_map, s1_domain, s1_token),
+        )
+        logger.info("[main] => %d rader i Google-lager.", len(records))
+        parfnum_map = build_parfnum_map(records)
+        logger.info("[main] => %d unika parfymnummer (%d dubbletter/ogiltiga rader).",
+                    len(parfnum_map), len(records) - len(parfnum_map))
+        flush_logs()
+
+        # 3) Uppdatera Store1 (master) och Store2 (matchar "title" från Store1)
+        #    samtidigt. Olika butiker => separata rate limits, och store2 läser
+        #    bara store1-kartan som redan är hämtad, inte store1:s skrivningar.
+        logger.info("--- [UPPDATERA STORE 1 + STORE 2] ---")
+        run_concurrently(
+            (process_store1,
+             db_tags,
+             store1_map,
+             s1_domain,
+             s1_token,
+             s1_loc,
+             {
+                 "men": s1_men,
+                 "women": s1_women,
+                 "unisex": s1_uni,
+                 "bestsellers": s1_best
+             },
+             parfnum_map),
+            (process_store2,
+             db_tags,
+             store1_map,             # store1-produkter => "title"
+             s2_domain, s2_token,    # uppdaterar store2
+             s2_loc,
+             {
+                 "men": s2_men,
+                 "women": s2_women,
+                 "unisex": s2_uni,
+                 "bestsellers": s2_best
+             },
+             parfnum_map),
         )
 
-        print("\n[main] => KLART! Båda butiker uppdaterade.\n")
+        flush_logs()
+        logger.info("[main] => KLART! Båda butiker uppdaterade.")
 
     except Exception as e:
-        print(f"Fel i main(): {e}")
+        logger.exception("Fel i main(): %s", e)
+
+def flush_logs():
+    """
+    Tömmer loggbufferten (MemoryHandler) efter varje fas i main, så att
+    loggen aldrig ligger långt efter det som faktiskt händer.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+def setup_logging():
+    """
+    Loggar via en MemoryHandler: vanliga rader skrivs i block om 100 poster,
+    WARNING och värre (t.ex. omförsök och strypningar) töms direkt.
+    Returnerar handlern så att main kan tömma den.
+    """
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    buffered = logging.handlers.MemoryHandler(100, flushLevel=logging.WARNING, target=stream)
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(buffered)
+    return buffered
 
 if __name__=="__main__":
-    main()
+    log_handler = setup_logging()
+    try:
+        main()
+    finally:
+        log_handler.flush()
 